@@ -0,0 +1,262 @@
+"""
+Caches for SQL generated by the LLM: exact-match (SQLite-backed) and semantic (embeddings)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+import zipfile
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_LEVEL = 6
+# Upper bound on entries held in process memory by the exact-match cache
+MEMORY_CACHE_SIZE = 10_000
+
+# Literals that change the answer while barely moving the embedding: creator/video ids,
+# numbers ("100 000", "28", "10:00") and month names
+HEX_ID_RE = re.compile(r'\b[0-9a-f]{32}\b')
+NUMBER_RE = re.compile(r'\d+(?: \d{3})*')
+MONTH_RE = re.compile(r'\b(январ|феврал|март|апрел|ма(?=[йяе])|июн|июл|август|сентябр|октябр|ноябр|декабр)')
+
+
+def question_literals(question: str) -> Tuple[Tuple[str, ...], ...]:
+    """Ids, numbers and months of a question, in order; questions must agree on them to share SQL"""
+    text = " ".join(question.casefold().split())
+    ids = tuple(HEX_ID_RE.findall(text))
+    text = HEX_ID_RE.sub(" ", text)
+    numbers = tuple(str(int(number.replace(" ", ""))) for number in NUMBER_RE.findall(text))
+    months = tuple(MONTH_RE.findall(text))
+    return ids, numbers, months
+
+
+class LLMCache:
+    """Exact-match cache of LLM-generated SQL with an in-memory layer over SQLite"""
+
+    def __init__(self, path: str, ttl: float):
+        self.ttl = ttl
+        # Bounded so unique questions cannot grow memory without limit; SQLite keeps the full set
+        self._memory: TTLCache = TTLCache(maxsize=MEMORY_CACHE_SIZE, ttl=ttl)
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # sql holds zlib-compressed UTF-8; rows written before compression are plain TEXT
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, sql BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _compress(sql: str) -> bytes:
+        return zlib.compress(sql.encode("utf-8"), COMPRESSION_LEVEL)
+
+    @staticmethod
+    def _decompress(value) -> str:
+        if isinstance(value, bytes):
+            return zlib.decompress(value).decode("utf-8")
+        return value
+
+    @staticmethod
+    def make_key(model: str, prompt_version: int, params: Dict[str, Any], user_query: str) -> str:
+        """Return SHA256 key for (model, system prompt version, sampling params, normalized query)"""
+        payload = json.dumps(
+            {"model": model, "sp": prompt_version, "params": params, "q": user_query.strip().lower()},
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            sql, created_at = entry
+            if now - created_at <= self.ttl:
+                return sql
+            del self._memory[key]
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sql, created_at FROM llm_cache WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        sql, created_at = self._decompress(row[0]), row[1]
+        self._memory[key] = (sql, created_at)
+        return sql
+
+    def set(self, key: str, sql: str) -> None:
+        created_at = time.time()
+        self._memory[key] = (sql, created_at)
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, sql, created_at) VALUES (?, ?, ?)",
+                (key, self._compress(sql), created_at)
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class SemanticCache:
+    """
+    Nearest-neighbour cache of LLM-generated SQL keyed by question embeddings
+
+    Embeddings live in a fixed-size ring buffer: once it holds `capacity` rows,
+    a new entry overwrites the least recently used one. A similar question is
+    only reused if its ids, numbers and months match (see question_literals),
+    so "больше 1000" never gets the SQL of "больше 100 000".
+    """
+
+    def __init__(self, path: str, threshold: float, namespace: str, capacity: int):
+        self.path = path
+        self.threshold = threshold
+        # Entries written for another embedding model or prompt version are discarded on load
+        self.namespace = namespace
+        self.capacity = capacity
+        self._matrix: Optional[np.ndarray] = None
+        self._sqls: List[str] = []
+        self._questions: List[str] = []
+        self._literals: List[Tuple] = []
+        self._last_used: Optional[np.ndarray] = None
+        self._size = 0
+        # Set by add(); the owner persists the buffer with save() off the event loop
+        self.dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _allocate(self, dim: int) -> None:
+        self._matrix = np.zeros((self.capacity, dim), dtype=np.float32)
+        self._last_used = np.zeros(self.capacity, dtype=np.float64)
+        self._sqls = [""] * self.capacity
+        self._questions = [""] * self.capacity
+        self._literals = [()] * self.capacity
+        self._size = 0
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+
+        # A truncated or corrupt file only costs the cached answers, not the bot
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                # Rows without their question text cannot be checked against a new question
+                if str(data["namespace"]) != self.namespace or "questions" not in data.files:
+                    return
+                embeddings = data["embeddings"]
+                sqls = data["sqls"].tolist()
+                questions = data["questions"].tolist()
+                # Files written before the ring buffer carry no usage times
+                last_used = data["last_used"] if "last_used" in data.files else np.zeros(len(sqls))
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile, EOFError) as e:
+            logger.warning("Ignoring unreadable semantic cache %s: %s", self.path, e)
+            return
+
+        # Keep the most recently used rows if the capacity shrank since the file was written
+        keep = np.argsort(last_used)[::-1][:self.capacity]
+        self._allocate(embeddings.shape[1])
+        self._size = len(keep)
+        self._matrix[:self._size] = embeddings[keep]
+        self._last_used[:self._size] = last_used[keep]
+        for row, index in enumerate(keep):
+            self._sqls[row] = sqls[index]
+            self._questions[row] = questions[index]
+            self._literals[row] = question_literals(questions[index])
+
+    def save(self) -> None:
+        """Write the buffer to disk if it changed; blocking, so run it in a worker thread"""
+        with self._lock:
+            if not self.dirty:
+                return
+            # Copied under the lock so add() can keep writing while the file is saved
+            embeddings = self._matrix[:self._size].copy()
+            sqls = np.array(self._sqls[:self._size])
+            questions = np.array(self._questions[:self._size])
+            last_used = self._last_used[:self._size].copy()
+            self.dirty = False
+
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    namespace=np.array(self.namespace),
+                    embeddings=embeddings,
+                    sqls=sqls,
+                    questions=questions,
+                    last_used=last_used
+                )
+            os.replace(tmp_path, self.path)
+        except OSError:
+            self.dirty = True
+            raise
+
+    def lookup(self, embedding: Sequence[float], question: str) -> Optional[Tuple[str, float]]:
+        """Return (sql, similarity) of the closest cached question above the threshold with the same literals"""
+        if not self._size:
+            return None
+
+        scores = self._matrix[:self._size] @ self._normalize(embedding)
+        candidates = np.flatnonzero(scores >= self.threshold)
+        if not candidates.size:
+            return None
+
+        literals = question_literals(question)
+        for row in candidates[np.argsort(scores[candidates])[::-1]]:
+            if self._literals[row] == literals:
+                self._last_used[row] = time.time()
+                return self._sqls[row], float(scores[row])
+        return None
+
+    def add(self, embedding: Sequence[float], sql: str, question: str) -> None:
+        vector = self._normalize(embedding)
+
+        with self._lock:
+            if self._matrix is None:
+                self._allocate(vector.shape[0])
+
+            if self._size < self.capacity:
+                row = self._size
+                self._size += 1
+            else:
+                row = int(np.argmin(self._last_used))
+
+            self._matrix[row] = vector
+            self._sqls[row] = sql
+            self._questions[row] = question
+            self._literals[row] = question_literals(question)
+            self._last_used[row] = time.time()
+            self.dirty = True
@@ -4,24 +4,50 @@ Telegram Bot for Video Analytics using aiogram
 
 import asyncio
 import logging
+from aiohttp import web
+from aiolimiter import AsyncLimiter
 from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.filters import Command
+from aiogram.methods import SendChatAction, TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from config.settings import settings
-from bot.nlp_processor import NLPProcessor
+from bot.nlp_processor import nlp_processor
+from database.async_pool import init_pool, close_pool
 
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Questions answered at the same time; the rest wait so OpenAI and DB load stays bounded
+MAX_CONCURRENT_QUERIES = 32
+# Outgoing messages per second, kept below Telegram's global limit of 30 so replies
+# are not rejected with 429 and retried
+SEND_RATE_PER_SECOND = 28
+# Seconds before a Bot API call is given up (aiogram's default is 60), so a stalled
+# request does not hold a reply for long; long polling adds its own wait on top of this
+TELEGRAM_REQUEST_TIMEOUT = 15
+
 
 class VideoAnalyticsBot:
     def __init__(self):
-        self.bot = Bot(token=settings.telegram_bot_token)
+        session = AiohttpSession(timeout=TELEGRAM_REQUEST_TIMEOUT)
+        self.bot = Bot(token=settings.telegram_bot_token, session=session)
         self.dp = Dispatcher()
-        self.nlp_processor = NLPProcessor()
+        self.nlp_processor = nlp_processor
+        self._query_slots = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
+        self._send_limiter = AsyncLimiter(max_rate=SEND_RATE_PER_SECOND, time_period=1)
+        # The DB pool is opened before polling starts and closed after it stops;
+        # pending semantic cache entries are written on shutdown as well
+        self.dp.startup.register(init_pool)
+        self.dp.shutdown.register(close_pool)
+        self.dp.shutdown.register(self.nlp_processor.close)
         self.setup_handlers()
 
+    async def _send(self, method: TelegramMethod):
+        """Call a Telegram method once the outgoing rate limit allows it"""
+        async with self._send_limiter:
+            return await self.bot(method)
+
     def setup_handlers(self):
         """Setup message and command handlers"""
 
@@ -39,7 +65,7 @@ class VideoAnalyticsBot:
                 "• На сколько просмотров в сумме выросли все видео 28 ноября 2025?\n"
                 "• Сколько разных видео получали новые просмотры 27 ноября 2025?"
             )
-            await message.reply(welcome_text)
+            await self._send(message.reply(welcome_text))
 
         @self.dp.message(Command("help"))
         async def help_command(message: types.Message):
@@ -52,7 +78,7 @@ class VideoAnalyticsBot:
                 "• Сколько видео вышло в ноябре 2025?\n"
                 "• На сколько выросли просмотры вчера?"
             )
-            await message.reply(help_text)
+            await self._send(message.reply(help_text))
 
         @self.dp.message()
         async def handle_text_message(message: types.Message):
@@ -60,41 +86,80 @@ class VideoAnalyticsBot:
             user_query = message.text.strip()
 
             if not user_query:
-                await message.reply("Пожалуйста, введите вопрос.")
+                await self._send(message.reply("Пожалуйста, введите вопрос."))
                 return
 
-            # Show typing indicator
-            await self.bot.send_chat_action(message.chat.id, "typing")
+            # The typing indicator is sent while the query runs instead of before it
+            typing_task = asyncio.create_task(self._send(SendChatAction(chat_id=message.chat.id, action="typing")))
 
             try:
                 # Process the query
-                result = self.nlp_processor.process_query(user_query)
+                async with self._query_slots:
+                    result = await self.nlp_processor.process_query(user_query)
 
                 if result is not None:
                     # Send the numeric result
-                    await message.reply(str(result))
+                    reply_text = str(result)
                 else:
                     # Handle processing failure
-                    error_text = (
+                    reply_text = (
                         "Извините, не удалось обработать ваш запрос. "
                         "Пожалуйста, уточните вопрос или попробуйте другой формат."
                     )
-                    await message.reply(error_text)
                     logger.error(f"Failed to process query: {user_query}")
 
             except Exception as e:
                 logger.error(f"Error processing message: {e}")
-                await message.reply("Произошла ошибка при обработке запроса. Попробуйте позже.")
+                reply_text = "Произошла ошибка при обработке запроса. Попробуйте позже."
+
+            # A failed typing indicator must not prevent the reply
+            _, reply_error = await asyncio.gather(
+                typing_task, self._send(message.reply(reply_text)), return_exceptions=True
+            )
+            if isinstance(reply_error, Exception):
+                logger.error(f"Failed to send reply: {reply_error}")
 
     async def start_polling(self):
         """Start the bot with polling"""
         logger.info("Starting bot polling...")
         try:
+            # A webhook left over from a WEBHOOK_URL run makes getUpdates fail with 409 Conflict
+            await self.bot.delete_webhook()
             await self.dp.start_polling(self.bot)
         except Exception as e:
             logger.error(f"Error during polling: {e}")
             raise
 
+    async def start_webhook(self):
+        """Start the bot as an aiohttp webhook server"""
+        logger.info("Starting bot webhook on %s:%s%s", settings.webhook_host, settings.webhook_port, settings.webhook_path)
+        app = web.Application()
+        # Updates are acknowledged to Telegram right away and handled in background tasks
+        SimpleRequestHandler(
+            dispatcher=self.dp,
+            bot=self.bot,
+            handle_in_background=True,
+            secret_token=settings.webhook_secret,
+        ).register(app, path=settings.webhook_path)
+        setup_application(app, self.dp, bot=self.bot)
+
+        runner = web.AppRunner(app)
+        await runner.setup()
+        try:
+            await self.bot.set_webhook(settings.webhook_url, secret_token=settings.webhook_secret)
+            site = web.TCPSite(runner, settings.webhook_host, settings.webhook_port)
+            await site.start()
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    async def start(self):
+        """Start the bot with a webhook if WEBHOOK_URL is set, otherwise with polling"""
+        if settings.webhook_url:
+            await self.start_webhook()
+        else:
+            await self.start_polling()
+
     async def shutdown(self):
         """Shutdown the bot gracefully"""
         logger.info("Shutting down bot...")
@@ -103,9 +168,11 @@ class VideoAnalyticsBot:
 
 async def main():
     """Main function to run the bot"""
+    # Configure logging once for the whole process
+    logging.basicConfig(level=settings.log_level)
     bot = VideoAnalyticsBot()
     try:
-        await bot.start_polling()
+        await bot.start()
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
@@ -0,0 +1,59 @@
+"""
+Shared asyncpg connection pool used by the bot's event loop
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+import asyncpg
+
+from config.settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+POOL_MIN_SIZE = 2
+POOL_MAX_SIZE = 20
+# asyncpg prepares every statement and keeps the plans per connection,
+# so repeated questions skip parsing and planning
+STATEMENT_CACHE_SIZE = 256
+
+_pool: Optional[asyncpg.Pool] = None
+_pool_lock = asyncio.Lock()
+
+
+async def _create_pool() -> asyncpg.Pool:
+    pool_kwargs = dict(min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, statement_cache_size=STATEMENT_CACHE_SIZE)
+    try:
+        return await asyncpg.create_pool(settings.database_url, **pool_kwargs)
+    except OSError as err:
+        if not settings.database_url_fallback:
+            raise
+        logger.warning("DB host 'postgres' is unreachable (%s), retrying with 'localhost'", err)
+        return await asyncpg.create_pool(settings.database_url_fallback, **pool_kwargs)
+
+
+async def init_pool() -> asyncpg.Pool:
+    """Create the pool if needed; registered as a dispatcher startup hook"""
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await _create_pool()
+    return _pool
+
+
+async def get_pool() -> asyncpg.Pool:
+    """Return the pool, creating it on first use outside the bot (scripts, tests)"""
+    if _pool is not None:
+        return _pool
+    return await init_pool()
+
+
+async def close_pool():
+    """Close the pool; registered as a dispatcher shutdown hook"""
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            await _pool.close()
+            _pool = None
@@ -1,61 +1,93 @@
+import logging
+import re
+import threading
+from typing import Callable, Optional, TypeVar
+
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from psycopg2 import OperationalError
+from psycopg2.pool import ThreadedConnectionPool
 from contextlib import contextmanager
-from urllib.parse import urlparse, urlunparse
 
 from config.settings import settings
 
 
-def _replace_host_in_url(url: str, new_host: str) -> str:
-    """Return connection URL with host replaced by new_host."""
-    parsed = urlparse(url)
-    netloc = parsed.netloc
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Connections are reused instead of paying a TCP + auth handshake per query
+POOL_MIN_CONNECTIONS = 2
+POOL_MAX_CONNECTIONS = 20
+
+_pool: Optional[ThreadedConnectionPool] = None
+_pool_lock = threading.Lock()
+
+UNKNOWN_POSTGRES_HOST_RE = re.compile(r'could not translate host name "postgres"')
+
+
+def _with_host_fallback(open_with: Callable[[str], T]) -> T:
+    """Call open_with(database_url), retrying with 'localhost' if host 'postgres' is unknown"""
+    try:
+        return open_with(settings.database_url)
+    except OperationalError as err:
+        if settings.database_url_fallback and UNKNOWN_POSTGRES_HOST_RE.search(str(err)):
+            logger.warning("DB host 'postgres' is unreachable, retrying with 'localhost'")
+            return open_with(settings.database_url_fallback)
+        raise
+
+
+def connect():
+    """Open a new standalone database connection"""
+    return _with_host_fallback(psycopg2.connect)
+
 
-    if "@" in netloc:
-        creds, hostport = netloc.rsplit("@", 1)
-    else:
-        creds, hostport = "", netloc
+def get_pool() -> ThreadedConnectionPool:
+    """Return the process-wide connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = _with_host_fallback(
+                    lambda dsn: ThreadedConnectionPool(POOL_MIN_CONNECTIONS, POOL_MAX_CONNECTIONS, dsn)
+                )
+    return _pool
 
-    if ":" in hostport:
-        _, port = hostport.split(":", 1)
-        hostport = f"{new_host}:{port}"
-    elif hostport:
-        hostport = new_host
 
-    new_netloc = f"{creds + '@' if creds else ''}{hostport}"
-    return urlunparse(parsed._replace(netloc=new_netloc))
+def close_pool():
+    """Close every pooled connection"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
 
 
 @contextmanager
 def get_db_connection():
-    """Context manager for database connections"""
-    conn = None
+    """Context manager for database connections borrowed from the pool"""
+    pool = get_pool()
+    conn = pool.getconn()
     try:
-        try:
-            conn = psycopg2.connect(settings.database_url)
-        except OperationalError as err:
-            if "could not translate host name \"postgres\"" in str(err) and "@postgres" in settings.database_url:
-                fallback_url = _replace_host_in_url(settings.database_url, "localhost")
-                print("DB host 'postgres' is unreachable, retrying with 'localhost'")
-                conn = psycopg2.connect(fallback_url)
-            else:
-                raise
         yield conn
     finally:
-        if conn:
-            conn.close()
+        # Open transactions are rolled back and broken connections discarded by the pool
+        pool.putconn(conn)
 
 
 @contextmanager
-def get_db_cursor():
-    """Context manager for database cursors"""
+def get_db_cursor(dict_rows: bool = True):
+    """Context manager for database cursors
+
+    Rows are dicts keyed by column name; dict_rows=False yields plain tuples,
+    skipping the per-row dict for callers that do not need column names.
+    """
+    cursor_factory = RealDictCursor if dict_rows else None
     with get_db_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        with conn.cursor(cursor_factory=cursor_factory) as cursor:
             try:
                 yield cursor
                 conn.commit()
             except Exception:
                 conn.rollback()
                 raise
-
@@ -6,8 +6,16 @@ Main entry point for the Video Analytics Telegram Bot
 import asyncio
 from bot.telegram_bot import main as run_bot
 
+try:
+    # libuv-based event loop, noticeably faster for network I/O; not available on Windows
+    import uvloop
+except ImportError:
+    uvloop = None
+
 
 if __name__ == "__main__":
     print("Starting Video Analytics Telegram Bot...")
-    asyncio.run(run_bot())
-
+    if uvloop is not None:
+        uvloop.run(run_bot())
+    else:
+        asyncio.run(run_bot())
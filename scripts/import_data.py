@@ -1,66 +1,63 @@
 #!/usr/bin/env python3
 """Script to import video data from JSON file into PostgreSQL"""
 
-import json
+import io
 import sys
 import os
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import Iterator, List, Dict, Any, Tuple
+
+import ijson
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from database.connection import get_db_cursor
 
 
-def load_json_data(file_path: str) -> Dict[str, Any]:
-    """Load JSON data from file"""
-    print(f"Loading data from {file_path}...")
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
-
+# Pending snapshots are flushed every this many rows so memory stays flat
+# for large exports
+INSERT_PAGE_SIZE = 1000
 
-def insert_videos(cursor, videos: List[Dict[str, Any]]) -> None:
-    """Insert videos into database"""
-    print(f"Inserting {len(videos)} videos...")
+VIDEO_COLUMNS = (
+    'id', 'creator_id', 'video_created_at', 'views_count', 'likes_count',
+    'comments_count', 'reports_count', 'created_at', 'updated_at'
+)
+SNAPSHOT_COLUMNS = (
+    'id', 'video_id', 'views_count', 'likes_count', 'comments_count',
+    'reports_count', 'delta_views_count', 'delta_likes_count',
+    'delta_comments_count', 'delta_reports_count', 'created_at', 'updated_at'
+)
 
-    video_query = """
-    INSERT INTO videos (id, creator_id, video_created_at, views_count, likes_count,
-                       comments_count, reports_count, created_at, updated_at)
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-    ON CONFLICT (id) DO NOTHING
-    """
+# Backslash escapes of COPY's text format
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
 
-    for video in videos:
-        cursor.execute(video_query, (
-            video['id'],
-            video['creator_id'],
-            video['video_created_at'],
-            video['views_count'],
-            video['likes_count'],
-            video['comments_count'],
-            video['reports_count'],
-            video['created_at'],
-            video['updated_at']
-        ))
-
-
-def insert_snapshots(cursor, video_id: str, snapshots: List[Dict[str, Any]]) -> None:
-    """Insert snapshots for a specific video"""
-    if not snapshots:
-        return
-
-    snapshot_query = """
-    INSERT INTO video_snapshots (id, video_id, views_count, likes_count, comments_count,
-                                reports_count, delta_views_count, delta_likes_count,
-                                delta_comments_count, delta_reports_count, created_at, updated_at)
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    ON CONFLICT (id) DO NOTHING
-    """
 
-    for snapshot in snapshots:
-        cursor.execute(snapshot_query, (
+def iter_videos(file_path: str) -> Iterator[Dict[str, Any]]:
+    """Stream videos from the JSON file one at a time"""
+    print(f"Loading data from {file_path}...")
+    with open(file_path, 'rb') as f:
+        yield from ijson.items(f, 'videos.item')
+
+
+def video_row(video: Dict[str, Any]) -> Tuple:
+    return (
+        video['id'],
+        video['creator_id'],
+        video['video_created_at'],
+        video['views_count'],
+        video['likes_count'],
+        video['comments_count'],
+        video['reports_count'],
+        video['created_at'],
+        video['updated_at']
+    )
+
+
+def snapshot_rows(video: Dict[str, Any]) -> List[Tuple]:
+    return [
+        (
             snapshot['id'],
-            video_id,
+            video['id'],
             snapshot['views_count'],
             snapshot['likes_count'],
             snapshot['comments_count'],
@@ -71,35 +68,88 @@ def insert_snapshots(cursor, video_id: str, snapshots: List[Dict[str, Any]]) ->
             snapshot['delta_reports_count'],
             snapshot['created_at'],
             snapshot['updated_at']
-        ))
+        )
+        for snapshot in video.pop('snapshots', None) or []
+    ]
 
 
-def import_data(json_file_path: str) -> None:
-    """Main import function"""
-    try:
-        # Load JSON data
-        data = load_json_data(json_file_path)
-        videos = data.get('videos', [])
+def copy_value(value: Any) -> str:
+    if value is None:
+        return '\\N'
+    return str(value).translate(COPY_ESCAPES)
 
-        if not videos:
-            print("❌ No videos found in JSON file")
-            return
 
-        print(f"Found {len(videos)} videos to import")
+def create_staging_tables(cursor) -> None:
+    """Temporary tables COPY loads into before rows are merged with ON CONFLICT"""
+    cursor.execute("CREATE TEMP TABLE videos_staging (LIKE videos) ON COMMIT DROP")
+    cursor.execute("CREATE TEMP TABLE video_snapshots_staging (LIKE video_snapshots) ON COMMIT DROP")
 
-        # Import data
-        with get_db_cursor() as cursor:
-            # Insert videos
-            insert_videos(cursor, videos)
 
-            # Insert snapshots for each video
-            total_snapshots = 0
-            for video in videos:
-                snapshots = video.get('snapshots', [])
-                insert_snapshots(cursor, video['id'], snapshots)
-                total_snapshots += len(snapshots)
+def copy_rows(cursor, table: str, columns: Tuple[str, ...], rows: List[Tuple]) -> None:
+    """COPY rows into the staging copy of table, then merge new ones into table"""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(map(copy_value, row)))
+        buf.write('\n')
+    buf.seek(0)
 
-            print(f"✅ Successfully imported {len(videos)} videos and {total_snapshots} snapshots")
+    column_list = ', '.join(columns)
+    cursor.copy_expert(f"COPY {table}_staging ({column_list}) FROM STDIN WITH (FORMAT text)", buf)
+    cursor.execute(f"""
+    INSERT INTO {table} ({column_list})
+    SELECT {column_list} FROM {table}_staging
+    ON CONFLICT (id) DO NOTHING
+    """)
+    cursor.execute(f"TRUNCATE {table}_staging")
+
+
+def insert_videos(cursor, rows: List[Tuple]) -> None:
+    """Insert video rows into database"""
+    copy_rows(cursor, 'videos', VIDEO_COLUMNS, rows)
+
+
+def insert_snapshots(cursor, rows: List[Tuple]) -> None:
+    """Insert snapshot rows into database"""
+    copy_rows(cursor, 'video_snapshots', SNAPSHOT_COLUMNS, rows)
+
+
+def import_data(json_file_path: str) -> None:
+    """Main import function"""
+    try:
+        with get_db_cursor(dict_rows=False) as cursor:
+            create_staging_tables(cursor)
+
+            total_videos = 0
+            total_snapshots = 0
+            pending_videos: List[Tuple] = []
+            pending_snapshots: List[Tuple] = []
+
+            def flush():
+                # Videos go first: snapshots reference them
+                if pending_videos:
+                    insert_videos(cursor, pending_videos)
+                    pending_videos.clear()
+                if pending_snapshots:
+                    insert_snapshots(cursor, pending_snapshots)
+                    pending_snapshots.clear()
+
+            for video in iter_videos(json_file_path):
+                pending_snapshots.extend(snapshot_rows(video))
+                pending_videos.append(video_row(video))
+                total_videos += 1
+                if len(pending_snapshots) >= INSERT_PAGE_SIZE or len(pending_videos) >= INSERT_PAGE_SIZE:
+                    total_snapshots += len(pending_snapshots)
+                    flush()
+                    print(f"Imported {total_videos} videos...")
+
+            total_snapshots += len(pending_snapshots)
+            flush()
+
+            if not total_videos:
+                print("❌ No videos found in JSON file")
+                return
+
+            print(f"✅ Successfully imported {total_videos} videos and {total_snapshots} snapshots")
 
     except Exception as e:
         print(f"❌ Import failed: {e}")
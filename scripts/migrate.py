@@ -3,24 +3,59 @@
 
 import sys
 import os
+from typing import Tuple
+
+import sqlparse
+
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database.connection import get_db_cursor
+from database.connection import connect
+
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), '..', 'database', 'schema.sql')
+
+# DDL may legitimately run long, but must not queue forever behind another lock
+SESSION_SETTINGS = (
+    "SET statement_timeout = 0",
+    "SET lock_timeout = '5s'",
+)
+
+
+def load_schema_sql() -> str:
+    """Read schema.sql"""
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def load_schema_statements() -> Tuple[str, ...]:
+    """schema.sql split into individual statements"""
+    return tuple(
+        statement.strip()
+        for statement in sqlparse.split(load_schema_sql())
+        if statement.strip()
+    )
 
 
 def run_migrations():
     """Run database migrations"""
     print("Running database migrations...")
 
-    # Read schema file
-    schema_path = os.path.join(os.path.dirname(__file__), '..', 'database', 'schema.sql')
-    with open(schema_path, 'r', encoding='utf-8') as f:
-        schema_sql = f.read()
+    statements = load_schema_statements()
 
     try:
-        with get_db_cursor() as cursor:
-            cursor.execute(schema_sql)
-        print("✅ Database schema created successfully!")
+        # Autocommit runs each statement on its own, which statements such as
+        # CREATE INDEX CONCURRENTLY require
+        conn = connect()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                for setting in SESSION_SETTINGS:
+                    cursor.execute(setting)
+                for statement in statements:
+                    cursor.execute(statement)
+        finally:
+            conn.close()
+        print(f"✅ Database schema created successfully! ({len(statements)} statements)")
     except Exception as e:
         print(f"❌ Migration failed: {e}")
         sys.exit(1)
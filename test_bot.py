@@ -3,6 +3,7 @@
 Test script for Video Analytics Bot functionality
 """
 
+import asyncio
 import sys
 import os
 import json
@@ -12,7 +13,44 @@ from pathlib import Path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from database.connection import get_db_cursor
-from bot.nlp_processor import NLPProcessor
+from database.async_pool import close_pool
+from bot.nlp_processor import NLPProcessor, nlp_processor, normalize_query
+
+
+# Questions answered by the local rules, with the SQL they must produce
+RULE_BASED_CASES = [
+    # Known test questions must not swallow the creator or the date of a longer question
+    (
+        "Сколько видео набрало больше 100 000 просмотров у креатора с id aca1061a9d324ecf8c3fa2bb32d7be63?",
+        "SELECT COUNT(*) FROM videos WHERE creator_id = 'aca1061a9d324ecf8c3fa2bb32d7be63' AND views_count > 100000",
+    ),
+    (
+        "Сколько видео набрало больше 100 000 просмотров 5 декабря 2025?",
+        "SELECT COUNT(*) FROM videos WHERE views_count > 100000 "
+        "AND video_created_at >= '2025-12-05' AND video_created_at < '2025-12-06'",
+    ),
+    # "новых видео" is about publications, "новые лайки" about snapshot deltas
+    (
+        "Сколько новых видео опубликовано 5 декабря 2025?",
+        "SELECT COUNT(*) FROM videos WHERE video_created_at >= '2025-12-05' AND video_created_at < '2025-12-06'",
+    ),
+    (
+        "Сколько разных видео получали новые лайки 5 декабря 2025?",
+        "SELECT COUNT(DISTINCT video_id) FROM video_snapshots "
+        "WHERE created_at >= '2025-12-05' AND created_at < '2025-12-06' AND delta_likes_count > 0",
+    ),
+    # Impossible dates are left to the LLM instead of failing
+    ("Сколько видео опубликовано 31 ноября 2025?", None),
+    ("Сколько видео опубликовано с 30 по 31 ноября 2025?", None),
+    # Open ranges, time windows, reversed ranges and joined filters are left to the LLM
+    ("Сколько видео вышло до 5 декабря 2025?", None),
+    ("Сколько видео вышло после 5 декабря 2025?", None),
+    ("Сколько видео вышло начиная с 5 декабря 2025?", None),
+    ("На сколько выросли просмотры 28 ноября 2025 с 10:00 до 15:00?", None),
+    ("Сколько новых просмотров получили видео 28 ноября 2025?", None),
+    ("Сколько видео вышло с 25 декабря 2025 по 5 января?", None),
+    ("На сколько выросли просмотры видео, опубликованных 28 ноября 2025?", None),
+]
 
 
 def test_database_connection():
@@ -57,11 +95,55 @@ def test_database_connection():
         return False
 
 
+def test_rule_based_sql():
+    """Test SQL generated by the local rules (no database or API needed)"""
+    print("\n🧪 Testing rule-based SQL...")
+
+    failures = 0
+    for query, expected in RULE_BASED_CASES:
+        sql = nlp_processor._rule_based_sql(normalize_query(query))
+        if sql == expected:
+            print(f"  ✅ {query}")
+        else:
+            failures += 1
+            print(f"  ❌ {query}\n     expected: {expected}\n     got:      {sql}")
+
+    print(f"\n✅ Rule-based tests passed: {len(RULE_BASED_CASES) - failures}/{len(RULE_BASED_CASES)}")
+    return failures == 0
+
+
+# Questions that differ only in punctuation but do not ask the same thing
+DISTINCT_QUESTION_PAIRS = [
+    ("Сколько всего видео есть в системе? Сколько вышло 5 декабря 2025",
+     "Сколько всего видео есть в системе, сколько вышло 5 декабря 2025"),
+    ("Сколько видео набрало больше 100000 просмотров? У креатора с id aca1061a9d324ecf8c5fa2bb32d7be63",
+     "Сколько видео набрало больше 100000 просмотров у креатора с id aca1061a9d324ecf8c5fa2bb32d7be63"),
+]
+
+
+def test_question_keys():
+    """Test that punctuation-only variants keep separate cache keys (no database or API needed)"""
+    print("\n🧪 Testing question cache keys...")
+
+    first, second = DISTINCT_QUESTION_PAIRS[0]
+    if nlp_processor._rule_based_sql(normalize_query(first)) == nlp_processor._rule_based_sql(normalize_query(second)):
+        print("❌ Punctuation variants produced the same SQL")
+        return False
+
+    for first, second in DISTINCT_QUESTION_PAIRS:
+        if normalize_query(first) == normalize_query(second):
+            print(f"❌ Questions share a cache key:\n     {first}\n     {second}")
+            return False
+
+    print("✅ Question keys test passed")
+    return True
+
+
 def test_nlp_processor():
     """Test NLP processor with sample queries"""
     print("\n🧪 Testing NLP processor...")
 
-    processor = NLPProcessor()
+    processor = nlp_processor
 
     # Test queries from TZ
     test_queries = [
@@ -71,18 +153,26 @@ def test_nlp_processor():
         "Сколько разных видео получали новые просмотры 27 ноября 2025?"
     ]
 
+    success_count = asyncio.run(_run_nlp_queries(processor, test_queries))
+
+    print(f"\n✅ NLP tests passed: {success_count}/{len(test_queries)}")
+    return success_count > 0
+
+
+async def _run_nlp_queries(processor: NLPProcessor, test_queries: list) -> int:
+    """Generate and execute SQL for each query, returning the number of successes"""
     success_count = 0
 
     for query in test_queries:
         print(f"\n  Testing: {query}")
         try:
             # Generate SQL
-            sql = processor.generate_sql_query(query)
+            sql = await processor.generate_sql_query(query)
             if sql:
                 print(f"  ✅ Generated SQL: {sql[:100]}...")
 
                 # Execute query
-                result = processor.execute_query_and_get_result(sql)
+                result = await processor.execute_query_and_get_result(sql)
                 if result is not None:
                     print(f"  ✅ Result: {result}")
                     success_count += 1
@@ -94,8 +184,9 @@ def test_nlp_processor():
         except Exception as e:
             print(f"  ❌ Error: {e}")
 
-    print(f"\n✅ NLP tests passed: {success_count}/{len(test_queries)}")
-    return success_count > 0
+    await close_pool()
+    await processor.close()
+    return success_count
 
 
 def test_data_integrity():
@@ -140,6 +231,8 @@ def main():
     tests = [
         test_database_connection,
         test_data_integrity,
+        test_rule_based_sql,
+        test_question_keys,
         test_nlp_processor
     ]
 
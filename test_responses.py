@@ -5,6 +5,20 @@ Test script to verify bot responses without requiring API keys
 
 import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def load_json(path):
+    """Parse a JSON file, falling back to the stdlib json module"""
+    if orjson is not None:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
 
 def test_expected_responses():
     """Test that our expected responses match the TZ requirements"""
@@ -13,39 +27,46 @@ def test_expected_responses():
     print("=" * 40)
 
     # Load actual data
-    with open("data/videos.json", "r", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_json("data/videos.json")
 
     videos = data["videos"]
 
-    # Collect all snapshots
-    all_snapshots = []
+    # Aggregate everything the test cases need in one pass over videos and snapshots
+    total_videos = 0
+    videos_over_100k = 0
+    growth_nov28 = 0
+    dedup_videos_nov27 = set()
     for video in videos:
-        all_snapshots.extend(video.get("snapshots", []))
+        total_videos += 1
+        if video["views_count"] > 100000:
+            videos_over_100k += 1
+        for s in video.get("snapshots", []):
+            day = s["created_at"][:10]
+            if day == "2025-11-28":
+                growth_nov28 += s["delta_views_count"]
+            elif day == "2025-11-27" and s["delta_views_count"] > 0:
+                dedup_videos_nov27.add(s["video_id"])
 
     # Test cases from TZ
     test_cases = [
         {
             "query": "Сколько всего видео есть в системе?",
-            "expected": len(videos),
+            "expected": total_videos,
             "description": "Total video count"
         },
         {
             "query": "Сколько видео набрало больше 100 000 просмотров за всё время?",
-            "expected": len([v for v in videos if v["views_count"] > 100000]),
+            "expected": videos_over_100k,
             "description": "Videos with >100k views"
         },
         {
             "query": "На сколько просмотров в сумме выросли все видео 28 ноября 2025?",
-            "expected": sum(s["delta_views_count"] for s in all_snapshots
-                          if s["created_at"].startswith("2025-11-28")),
+            "expected": growth_nov28,
             "description": "Total view growth on Nov 28, 2025"
         },
         {
             "query": "Сколько разных видео получали новые просмотры 27 ноября 2025?",
-            "expected": len(set(s["video_id"] for s in all_snapshots
-                              if s["created_at"].startswith("2025-11-27")
-                              and s["delta_views_count"] > 0)),
+            "expected": len(dedup_videos_nov27),
             "description": "Videos with new views on Nov 27, 2025"
         }
     ]
@@ -8,6 +8,34 @@ import sys
 import json
 from pathlib import Path
 
+try:
+    # Several times faster than json on the large numeric arrays in videos.json
+    import orjson
+except ImportError:
+    orjson = None
+
+
+REQUIRED_VIDEO_FIELDS = frozenset({
+    "id", "creator_id", "video_created_at", "views_count",
+    "likes_count", "comments_count", "reports_count",
+    "created_at", "updated_at", "snapshots"
+})
+REQUIRED_SNAPSHOT_FIELDS = frozenset({
+    "id", "video_id", "views_count", "likes_count",
+    "comments_count", "reports_count", "delta_views_count",
+    "delta_likes_count", "delta_comments_count", "delta_reports_count",
+    "created_at", "updated_at"
+})
+
+
+def load_json(path):
+    """Parse a JSON file, with orjson when it is installed"""
+    if orjson is not None:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
 
 def check_files():
     """Check if all required files exist"""
@@ -47,8 +75,7 @@ def check_json_structure():
     print("🔍 Checking JSON data structure...")
 
     try:
-        with open("data/videos.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = load_json("data/videos.json")
 
         videos = data.get("videos", [])
         if not videos:
@@ -57,32 +84,17 @@ def check_json_structure():
 
         # Check first video structure
         video = videos[0]
-        required_video_fields = [
-            "id", "creator_id", "video_created_at", "views_count",
-            "likes_count", "comments_count", "reports_count",
-            "created_at", "updated_at", "snapshots"
-        ]
-
-        for field in required_video_fields:
-            if field not in video:
-                print(f"❌ Missing field '{field}' in video structure")
-                return False
+        if not REQUIRED_VIDEO_FIELDS.issubset(video):
+            print(f"❌ Missing fields {sorted(REQUIRED_VIDEO_FIELDS - video.keys())} in video structure")
+            return False
 
         # Check snapshots structure
         snapshots = video.get("snapshots", [])
         if snapshots:
             snapshot = snapshots[0]
-            required_snapshot_fields = [
-                "id", "video_id", "views_count", "likes_count",
-                "comments_count", "reports_count", "delta_views_count",
-                "delta_likes_count", "delta_comments_count", "delta_reports_count",
-                "created_at", "updated_at"
-            ]
-
-            for field in required_snapshot_fields:
-                if field not in snapshot:
-                    print(f"❌ Missing field '{field}' in snapshot structure")
-                    return False
+            if not REQUIRED_SNAPSHOT_FIELDS.issubset(snapshot):
+                print(f"❌ Missing fields {sorted(REQUIRED_SNAPSHOT_FIELDS - snapshot.keys())} in snapshot structure")
+                return False
 
         print(f"✅ JSON structure valid - {len(videos)} videos, {len(snapshots)} snapshots per video")
         return True
@@ -165,8 +177,7 @@ def calculate_expected_results():
     print("🔍 Calculating expected query results...")
 
     try:
-        with open("data/videos.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = load_json("data/videos.json")
 
         videos = data["videos"]
 
@@ -176,18 +187,20 @@ def calculate_expected_results():
         # Query 2: Videos with >100k views
         videos_over_100k = len([v for v in videos if v["views_count"] > 100000])
 
-        # Collect all snapshots
-        all_snapshots = []
-        for video in videos:
-            all_snapshots.extend(video.get("snapshots", []))
-
         # Query 3: Total view growth on Nov 28, 2025
-        nov28_snapshots = [s for s in all_snapshots if s["created_at"].startswith("2025-11-28")]
-        total_growth_nov28 = sum(s["delta_views_count"] for s in nov28_snapshots)
-
         # Query 4: Videos with new views on Nov 27, 2025
-        nov27_snapshots = [s for s in all_snapshots if s["created_at"].startswith("2025-11-27")]
-        videos_with_new_views_nov27 = len(set(s["video_id"] for s in nov27_snapshots if s["delta_views_count"] > 0))
+        # Both come from one pass over the snapshots
+        nov27, nov28 = "2025-11-27", "2025-11-28"
+        total_growth_nov28 = 0
+        nov27_video_ids = set()
+        for video in videos:
+            for s in video.get("snapshots", []):
+                day = s["created_at"][:10]
+                if day == nov28:
+                    total_growth_nov28 += s["delta_views_count"]
+                elif day == nov27 and s["delta_views_count"] > 0:
+                    nov27_video_ids.add(s["video_id"])
+        videos_with_new_views_nov27 = len(nov27_video_ids)
 
         print("📊 Expected results:")
         print(f"   - Total videos: {total_videos}")